@@ -1,74 +1,238 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 import os
+import re
 import json
 import base64
-from datetime import datetime
-from PIL import Image
+from time import time, strftime, gmtime
 from io import BytesIO
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, wait
+from PIL import Image, ImageFile
 
-s3 = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+# Keep warm-invocation connections alive and the pool large enough for concurrent requests
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 3}
+)
+
+# Large outputs are uploaded as parallel multipart parts instead of one sequential PUT
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_THRESHOLD,
+    max_concurrency=4,
+    use_threads=True
+)
+
+s3 = boto3.client('s3', config=BOTO_CONFIG)
 
 BUCKET_NAME = os.environ['BUCKET_NAME']
 UPLOAD_PREFIX = os.environ.get('UPLOAD_PREFIX', 'uploads/')
 RESIZED_PREFIX = os.environ.get('RESIZED_PREFIX', 'resized/')
-DDB_TABLE = os.environ.get('DDB_TABLE', 'image_metadata')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
 RESIZE_WIDTH = 800
+JPEG_QUALITY = 85
+# Box-reduce RGB/L sources by an integer factor first, keeping >= 3x the target width for the resampler
+REDUCING_GAP = 3.0
+
+# Resolve credentials and open the S3 connection during INIT rather than on the first request
+try:
+    s3.head_bucket(Bucket=BUCKET_NAME)
+except Exception as e:
+    print(f"Pre-warm failed, continuing: {e}")
+
+# Shared across warm invocations for S3 I/O that can overlap with image processing
+_pool = ThreadPoolExecutor(max_workers=4)
+
+# Cheap check on the start of a request body before committing to a full base64 decode
+BASE64_PREFIX_RE = re.compile(rb'^[A-Za-z0-9+/=\s]{16,}$')
+
+# Encode a resized image in one chunk instead of 64 KB pieces
+ImageFile.MAXBLOCK = 16 * 1024 * 1024
+
+# Needed to convert non-sRGB images before their ICC profile is dropped; keep profiles if unavailable
+try:
+    from PIL import ImageCms
+    SRGB_PROFILE = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+except ImportError:
+    ImageCms = None
+
+# libturbojpeg is bundled under lib/ in the deployment package; fall back to Pillow if it can't be loaded
+try:
+    import numpy as np
+    from turbojpeg import (
+        TurboJPEG, TJCS_CMYK, TJCS_GRAY, TJCS_YCCK, TJPF_GRAY, TJPF_RGB, TJSAMP_GRAY, TJSAMP_422
+    )
+    jpeg = TurboJPEG(os.environ.get('TURBOJPEG_LIB'))
+except Exception as e:
+    print(f"TurboJPEG unavailable, using Pillow for JPEG: {e}")
+    jpeg = None
+
+def safe_event(event):
+    # Drop the (possibly multi-MB base64) body before logging an event
+    return {k: v for k, v in event.items() if k != 'body'}
+
+def looks_like_base64(body):
+    prefix = body[:64]
+    if isinstance(prefix, str):
+        prefix = prefix.encode('latin1', 'replace')
+    return BASE64_PREFIX_RE.match(prefix) is not None
 
-table = dynamodb.Table(DDB_TABLE)
+def is_jpeg(image_bytes):
+    # Sniff the SOI marker; API uploads are always tagged image/jpeg and S3 content types vary
+    return image_bytes[:3] == b'\xff\xd8\xff'
+
+def jpeg_scaling_factor(width):
+    # Largest DCT scale that still leaves at least 2x the target width for LANCZOS
+    for denom in (8, 4, 2):
+        if width // denom >= RESIZE_WIDTH * 2:
+            return (1, denom)
+    return None
+
+def resample_filter(width):
+    # Near the target size BILINEAR's smaller kernel is indistinguishable from LANCZOS
+    return Image.BILINEAR if width < RESIZE_WIDTH * 1.5 else Image.LANCZOS
+
+def convert_to_srgb(img):
+    # Returns the image and the ICC profile to save with it. Dropping a non-sRGB profile without
+    # converting the pixels shifts colours, so convert where possible and otherwise keep the profile.
+    icc_profile = img.info.get('icc_profile')
+    if not icc_profile:
+        return img, None
+    if ImageCms is None:
+        return img, icc_profile
+    try:
+        source_profile = ImageCms.ImageCmsProfile(BytesIO(icc_profile))
+        if 'srgb' in ImageCms.getProfileDescription(source_profile).lower():
+            return img, None
+        return ImageCms.profileToProfile(img, source_profile, SRGB_PROFILE), None
+    except (ImageCms.PyCMSError, OSError, ValueError) as e:
+        print(f"Keeping ICC profile, sRGB conversion failed: {e}")
+        return img, icc_profile
+
+def resize_jpeg(image_bytes, width, colorspace):
+    # Keep grayscale JPEGs single-channel instead of expanding them to RGB
+    if colorspace == TJCS_GRAY:
+        pixel_format, subsample = TJPF_GRAY, TJSAMP_GRAY
+    else:
+        pixel_format, subsample = TJPF_RGB, TJSAMP_422
+
+    arr = jpeg.decode(image_bytes, pixel_format=pixel_format, scaling_factor=jpeg_scaling_factor(width))
+    img = Image.fromarray(arr[:, :, 0] if pixel_format == TJPF_GRAY else arr)
+    ratio = RESIZE_WIDTH / float(img.width)
+    height = int((float(img.height) * float(ratio)))
+    resized_img = img.resize((RESIZE_WIDTH, height), resample_filter(img.width), reducing_gap=REDUCING_GAP)
+
+    resized_arr = np.asarray(resized_img)
+    if resized_arr.ndim == 2:
+        resized_arr = resized_arr[:, :, np.newaxis]
+    return jpeg.encode(resized_arr, quality=JPEG_QUALITY, pixel_format=pixel_format, jpeg_subsample=subsample)
+
+def image_metadata(original_key, size_bytes):
+    # Stored as S3 user metadata on the resized object; read it back with head_object
+    return {
+        'original-key': quote(original_key, safe='/'),
+        'size-bytes': str(size_bytes),
+        'timestamp': strftime('%Y-%m-%dT%H:%M:%SZ', gmtime())
+    }
 
-def process_image(file_name, image_bytes, content_type):
-    # Create BytesIO object and ensure we're at the beginning
+def upload_resized(resized_key, body, size_bytes, content_type, original_key):
+    metadata = image_metadata(original_key, size_bytes)
+    if size_bytes > MULTIPART_THRESHOLD:
+        fileobj = body if hasattr(body, 'read') else BytesIO(body)
+        extra_args = {'ContentType': content_type, 'Metadata': metadata}
+        s3.upload_fileobj(fileobj, BUCKET_NAME, resized_key, ExtraArgs=extra_args, Config=TRANSFER_CONFIG)
+    else:
+        s3.put_object(Bucket=BUCKET_NAME, Key=resized_key, Body=body, ContentType=content_type, ContentLength=size_bytes, Metadata=metadata)
+
+def store_unresized(resized_key, image_bytes, content_type, original_key, copy_original):
+    # Already within the target width: copy server-side when the original is in S3, else upload the bytes we hold
+    if copy_original:
+        s3.copy_object(
+            Bucket=BUCKET_NAME,
+            CopySource={'Bucket': BUCKET_NAME, 'Key': original_key},
+            Key=resized_key,
+            ContentType=content_type,
+            Metadata=image_metadata(original_key, len(image_bytes)),
+            MetadataDirective='REPLACE'
+        )
+    else:
+        upload_resized(resized_key, image_bytes, len(image_bytes), content_type, original_key)
+    return resized_key, len(image_bytes)
+
+def process_image(file_name, image_bytes, content_type, original_key, copy_original=False):
+    resized_key = f"{RESIZED_PREFIX}{file_name}"
+
+    if jpeg is not None and is_jpeg(image_bytes):
+        width, _, _, colorspace = jpeg.decode_header(image_bytes)
+        # libjpeg can't convert CMYK/YCCK to RGB, so those fall through to Pillow below
+        if colorspace not in (TJCS_CMYK, TJCS_YCCK):
+            if width <= RESIZE_WIDTH:
+                return store_unresized(resized_key, image_bytes, content_type, original_key, copy_original)
+            body = resize_jpeg(image_bytes, width, colorspace)
+            upload_resized(resized_key, body, len(body), content_type, original_key)
+            return resized_key, len(body)
+
+    # Create BytesIO object and ensure we're at the beginning (shares the bytes buffer, no copy)
     image_buffer = BytesIO(image_bytes)
     image_buffer.seek(0)  # CRITICAL: Reset pointer to beginning
     
     with Image.open(image_buffer) as img:
+        if img.width <= RESIZE_WIDTH:
+            return store_unresized(resized_key, image_bytes, content_type, original_key, copy_original)
+
+        if img.format == 'JPEG':
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale, keeping 2x the target for LANCZOS
+            img.draft('RGB', (RESIZE_WIDTH * 2, RESIZE_WIDTH * 2 * img.height // img.width))
         ratio = RESIZE_WIDTH / float(img.width)
         height = int((float(img.height) * float(ratio)))
-        resized_img = img.resize((RESIZE_WIDTH, height), Image.LANCZOS)
+        resized_img = img.resize((RESIZE_WIDTH, height), resample_filter(img.width), reducing_gap=REDUCING_GAP)
         
         buffer = BytesIO()
         # Preserve original format or default to JPEG
         format_to_save = img.format if img.format else 'JPEG'
-        resized_img.save(buffer, format=format_to_save)
+        # Thumbnails don't need the original's EXIF, or an ICC profile once they are in sRGB
+        resized_img, icc_profile = convert_to_srgb(resized_img)
+        save_options = {'exif': b'', 'icc_profile': icc_profile}
+        if format_to_save == 'JPEG':
+            save_options.update(quality=JPEG_QUALITY, optimize=False, progressive=False)
+        resized_img.save(buffer, format=format_to_save, **save_options)
+        size_bytes = buffer.tell()
         buffer.seek(0)
         
-        resized_key = f"{RESIZED_PREFIX}{file_name}"
-        s3.put_object(Bucket=BUCKET_NAME, Key=resized_key, Body=buffer.getvalue(), ContentType=content_type)
+        # Stream the buffer itself rather than copying it out with getvalue()
+        upload_resized(resized_key, buffer, size_bytes, content_type, original_key)
         
-        return resized_key, len(buffer.getvalue())
-
-def save_metadata(image_id, original_key, resized_key, size_bytes):
-    timestamp = datetime.utcnow().isoformat()
-    item = {
-        'image_id': image_id,
-        'original_key': original_key,
-        'resized_key': resized_key,
-        'size_bytes': size_bytes,
-        'timestamp': timestamp
-    }
-    table.put_item(Item=item)
+        return resized_key, size_bytes
 
-def handle_s3_event(event):
-    for record in event['Records']:
-        key = record['s3']['object']['key']
-        if not key.startswith(UPLOAD_PREFIX):
-            print(f"Skipping non-upload key: {key}")
-            continue
+def handle_s3_record(record):
+    key = record['s3']['object']['key']
+    if not key.startswith(UPLOAD_PREFIX):
+        print(f"Skipping non-upload key: {key}")
+        return
 
-        file_name = key.split('/')[-1]
-        response = s3.get_object(Bucket=BUCKET_NAME, Key=key)
-        image_content = response['Body'].read()
-        content_type = response['ContentType']
+    file_name = key.split('/')[-1]
+    response = s3.get_object(Bucket=BUCKET_NAME, Key=key)
+    image_content = response['Body'].read()
+    content_type = response['ContentType']
 
-        resized_key, size_bytes = process_image(file_name, image_content, content_type)
-        save_metadata(file_name, key, resized_key, size_bytes)
+    process_image(file_name, image_content, content_type, key, copy_original=True)
+
+def handle_s3_event(event):
+    records = event['Records']
+    # Overlap S3 round-trips across records; boto3 clients are thread-safe
+    with ThreadPoolExecutor(max_workers=min(len(records), 8)) as pool:
+        futures = [pool.submit(handle_s3_record, record) for record in records]
+        for future in futures:
+            future.result()
 
 def handle_api_event(event):
     try:
-        print(f"API Gateway event keys: {list(event.keys())}")
-        
-        body = event.get('body', '')
+        # Take the body out of the event so the base64 text can be freed once decoded
+        body = event.pop('body', None) or ''
         is_base64 = event.get('isBase64Encoded', False)
         
         if not body:
@@ -79,9 +243,18 @@ def handle_api_event(event):
         
         print(f"Body type: {type(body)}, isBase64Encoded: {is_base64}")
         
-        # API Gateway sends binary data as base64 string regardless of isBase64Encoded flag
+        # API Gateway sends binary data as base64 string regardless of isBase64Encoded flag,
+        # so sniff the prefix rather than letting b64decode scan a raw payload just to fail
+        if not is_base64 and not looks_like_base64(body):
+            print("Body does not look like base64")
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'Failed to decode image data'})
+            }
+
         try:
             image_bytes = base64.b64decode(body)
+            del body
             print(f"Successfully decoded base64, image size: {len(image_bytes)} bytes")
         except Exception as e:
             print(f"Base64 decode failed: {e}")
@@ -99,20 +272,24 @@ def handle_api_event(event):
 
         # Get filename from query parameters
         query_params = event.get('queryStringParameters') or {}
-        file_name = query_params.get('filename', f'image_{int(datetime.utcnow().timestamp())}.jpg')
+        file_name = query_params.get('filename', f'image_{int(time())}.jpg')
         key = f"{UPLOAD_PREFIX}{file_name}"
 
         print(f"Processing image: {file_name}")
 
-        # Upload original to S3
-        s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=image_bytes, ContentType='image/jpeg')
-        print(f"Uploaded original image to {key}")
+        # Upload original to S3 while the resize runs
+        fut_orig = _pool.submit(s3.put_object, Bucket=BUCKET_NAME, Key=key, Body=image_bytes, ContentType='image/jpeg')
 
         # Process and resize image  
-        resized_key, size_bytes = process_image(file_name, image_bytes, 'image/jpeg')
-        save_metadata(file_name, key, resized_key, size_bytes)
+        try:
+            resized_key, size_bytes = process_image(file_name, image_bytes, 'image/jpeg', key)
+        finally:
+            # Never return (letting Lambda freeze the environment) with the original PUT still in flight
+            wait([fut_orig])
+        fut_orig.result()
+        print(f"Uploaded original image to {key}")
         
-        print(f"Successfully processed image: {file_name}")
+        print(f"Successfully processed image: {file_name} ({size_bytes} bytes)")
 
         return {
             'statusCode': 200,
@@ -134,7 +311,8 @@ def handle_api_event(event):
 
 def lambda_handler(event, context):
     try:
-        print(f"Lambda invoked with event: {json.dumps(event)}")
+        if LOG_LEVEL == 'DEBUG':
+            print(f"Lambda invoked with event: {json.dumps(safe_event(event))}")
         
         if 'Records' in event and event['Records'] and 's3' in event['Records'][0]:
             print("Processing S3 event")
@@ -42,7 +42,7 @@ resource "aws_iam_role" "lambda_exec_role" {
   })
 }
 
-# IAM policy for Lambda to access S3, DynamoDB and CloudWatch
+# IAM policy for Lambda to access S3 and CloudWatch
 resource "aws_iam_role_policy" "lambda_policy" {
   name = "lambda_s3_policy"
   role = aws_iam_role.lambda_exec_role.id
@@ -53,6 +53,7 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Action = [
           "s3:GetObject",
           "s3:PutObject",
+          "s3:AbortMultipartUpload",
           "s3:ListBucket"
         ],
         Effect = "Allow",
@@ -61,16 +62,6 @@ resource "aws_iam_role_policy" "lambda_policy" {
           "${aws_s3_bucket.image_bucket.arn}/*"
         ]
       },
-      {
-        Action = [
-          "dynamodb:PutItem",
-          "dynamodb:GetItem",
-          "dynamodb:UpdateItem",
-          "dynamodb:DeleteItem"
-        ],
-        Effect = "Allow",
-        Resource = aws_dynamodb_table.image_metadata.arn
-      },
       {
         Action = [
           "logs:CreateLogGroup",
@@ -84,7 +75,8 @@ resource "aws_iam_role_policy" "lambda_policy" {
   })
 }
 
-# DynamoDB table for image metadata
+# DynamoDB table for image metadata; no longer written by the Lambda (metadata now lives on the
+# resized S3 objects) but kept until the existing rows have been exported
 resource "aws_dynamodb_table" "image_metadata" {
   name         = "image_metadata"
   billing_mode = "PAY_PER_REQUEST"
@@ -94,6 +86,10 @@ resource "aws_dynamodb_table" "image_metadata" {
     name = "image_id"
     type = "S"
   }
+
+  lifecycle {
+    prevent_destroy = true
+  }
 }
 
 # Lambda function
@@ -111,7 +107,7 @@ resource "aws_lambda_function" "image_processor" {
       BUCKET_NAME   = aws_s3_bucket.image_bucket.bucket
       UPLOAD_PREFIX = "uploads/"
       RESIZED_PREFIX = "resized/"
-      DDB_TABLE     = aws_dynamodb_table.image_metadata.name
+      TURBOJPEG_LIB = "/var/task/lib/libturbojpeg.so.0"
     }
   }
 }